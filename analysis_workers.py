@@ -0,0 +1,287 @@
+"""
+Analysis Workers
+Stateless worker processes for the IVF Drug-Gene Interaction Analyser
+
+Workers never import the Streamlit app. The knowledge base is compiled into
+a read-only snapshot: a small key index (drugs, genes and impact keys)
+followed by the impact records. Every worker memory-maps the same file, so
+the records live once in the shared page cache however many workers or app
+replicas run on a node. A worker parses only the key index and decodes an
+impact record from the mapping when a variant matches it.
+
+Results are stored in a shared SQLite cache on disk, used by all workers and
+by app replicas on the same node. Starting a pool keeps the snapshots and
+cache rows of the newest KB_KEEP_VERSIONS database versions and removes the
+rest. Replicas still on an earlier version can therefore keep starting
+workers during a rolling deploy.
+
+Enable from the app with:
+IVFPGX_WORKERS=4 streamlit run variant_analyzer.py
+"""
+
+import glob
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import sqlite3
+import struct
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+CACHE_FILENAME = "results.sqlite3"
+CACHE_MAX_ROWS = 10000
+KB_MAGIC = b"IVFPGXKB1\n"
+KB_KEEP_VERSIONS = 3
+# Seconds a worker waits for the cache lock before skipping the cache
+CACHE_BUSY_TIMEOUT = 0.5
+
+# Per-worker state, set once by _init_worker
+_kb_map = None
+_kb_index = None
+_kb_version = None
+_cache = None
+
+def normalize_variants(variant_input):
+    """Split input into upper-cased variants, one per non-empty line"""
+    return [v.strip().upper() for v in variant_input.split('\n') if v.strip()]
+
+def match_variants(variant_input, database):
+    """Analyze input variants against a drug-gene database"""
+    index = [
+        (drug, drug_data['genes'], list(drug_data['impacts'].items()))
+        for drug, drug_data in database.items()
+    ]
+    return match_index(variant_input, index, lambda impact_data: impact_data)
+
+def match_index(variant_input, index, load_impact):
+    """Analyze input variants against a KB index, loading only matched impacts
+
+    Each index entry is (drug, genes, impacts), where impacts is a list of
+    (impact_key, ref) pairs and load_impact(ref) returns the impact details.
+    """
+    input_variants = normalize_variants(variant_input)
+
+    if not input_variants:
+        return None
+
+    drug_results = {}
+
+    for drug, genes, impacts in index:
+        matched_impacts = []
+        no_impact_genes = []
+
+        # Check for matching variants
+        for variant in input_variants:
+            for impact_key, ref in impacts:
+                # Flexible matching
+                if (variant in impact_key.replace('_', ' ').upper() or
+                    impact_key.replace('_', ' ').upper() in variant or
+                    variant.split('_')[0] in impact_key.split('_')[0]):
+                    matched_impacts.append({
+                        'key': impact_key,
+                        'data': load_impact(ref)
+                    })
+
+        # Check for genes without impact
+        for gene in genes:
+            has_match = any(gene.upper() in v or v.split('_')[0] in gene for v in input_variants)
+            has_impact = any(gene in m['key'] for m in matched_impacts)
+            if has_match and not has_impact:
+                no_impact_genes.append(gene)
+
+        drug_results[drug] = {
+            'impacts': matched_impacts,
+            'no_impact_genes': no_impact_genes,
+            'relevant_genes': genes
+        }
+
+    return drug_results
+
+def encode_kb(database):
+    """Encode the database as a snapshot: magic, index length, key index, impact records"""
+    records = []
+    index = []
+    offset = 0
+
+    for drug, drug_data in database.items():
+        impacts = []
+        for impact_key, impact_data in drug_data['impacts'].items():
+            record = json.dumps(impact_data, separators=(',', ':')).encode('utf-8')
+            impacts.append([impact_key, offset, len(record)])
+            records.append(record)
+            offset += len(record)
+        index.append([drug, drug_data['genes'], impacts])
+
+    index_bytes = json.dumps(index, separators=(',', ':')).encode('utf-8')
+    return KB_MAGIC + struct.pack('<Q', len(index_bytes)) + index_bytes + b''.join(records)
+
+def read_kb_index(buffer):
+    """Parse the key index of a snapshot; impact records stay in the buffer
+
+    Returns an index for match_index whose refs are (offset, length) slices
+    of the buffer.
+    """
+    if buffer[:len(KB_MAGIC)] != KB_MAGIC:
+        raise ValueError("Not an IVF drug-gene KB snapshot")
+
+    index_start = len(KB_MAGIC) + 8
+    (index_length,) = struct.unpack_from('<Q', buffer, len(KB_MAGIC))
+    records_start = index_start + index_length
+
+    return [
+        (drug, genes, [(impact_key, (records_start + offset, length)) for impact_key, offset, length in impacts])
+        for drug, genes, impacts in json.loads(buffer[index_start:records_start])
+    ]
+
+def compile_kb(database, data_dir):
+    """Write the database as a versioned read-only snapshot and return its path"""
+    payload = encode_kb(database)
+    version = hashlib.sha256(payload).hexdigest()[:16]
+    path = os.path.join(data_dir, f"kb-{version}.kb")
+
+    # Snapshots are immutable, so an existing file for this version is reused
+    if not os.path.exists(path):
+        fd, tmp_path = tempfile.mkstemp(dir=data_dir, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, path)
+
+    return path
+
+def snapshot_version(kb_path):
+    """Return the KB version encoded in a snapshot filename"""
+    return os.path.basename(kb_path)[len("kb-"):-len(".kb")]
+
+def open_cache(cache_path):
+    """Open the shared result cache, creating its table if needed"""
+    conn = sqlite3.connect(cache_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(results)")]
+    # Caches from before kb_version was tracked cannot be pruned, so start over
+    if columns and 'kb_version' not in columns:
+        conn.execute("DROP TABLE results")
+    conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, kb_version TEXT NOT NULL, value TEXT NOT NULL)")
+    conn.commit()
+    return conn
+
+def _snapshot_mtime(path):
+    """Return when a snapshot was last used, or 0 if it has already been removed"""
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0
+
+def prune_data_dir(data_dir, kb_path, conn):
+    """Keep only the newest KB versions' snapshots and cache rows and cap the cache size
+
+    Pools on an earlier version start workers lazily from their own snapshot,
+    so those snapshots stay until KB_KEEP_VERSIONS newer versions exist.
+    """
+    # Mark the current snapshot as the most recently used
+    os.utime(kb_path)
+    current = os.path.abspath(kb_path)
+    others = [
+        path for path in map(os.path.abspath, glob.glob(os.path.join(data_dir, "kb-*.kb")))
+        if path != current
+    ]
+    others.sort(key=_snapshot_mtime, reverse=True)
+    keep = [current] + others[:KB_KEEP_VERSIONS - 1]
+
+    for path in others[KB_KEEP_VERSIONS - 1:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    versions = [snapshot_version(path) for path in keep]
+    with conn:
+        conn.execute(
+            f"DELETE FROM results WHERE kb_version NOT IN ({', '.join('?' * len(versions))})",
+            versions
+        )
+        conn.execute(
+            "DELETE FROM results WHERE rowid NOT IN (SELECT rowid FROM results ORDER BY rowid DESC LIMIT ?)",
+            (CACHE_MAX_ROWS,)
+        )
+
+def _cache_key(variant_input):
+    """Return the cache key for an input under the loaded KB version"""
+    variants = '\n'.join(normalize_variants(variant_input))
+    return hashlib.sha256(f"{_kb_version}\n{variants}".encode('utf-8')).hexdigest()
+
+def _load_impact(ref):
+    """Decode one impact record from the shared KB mapping"""
+    offset, length = ref
+    return json.loads(_kb_map[offset:offset + length])
+
+def _init_worker(kb_path, cache_path):
+    """Map the KB snapshot, read its key index and open the result cache"""
+    global _kb_map, _kb_index, _kb_version, _cache
+    with open(kb_path, 'rb') as f:
+        _kb_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    _kb_index = read_kb_index(_kb_map)
+    _kb_version = snapshot_version(kb_path)
+    _cache = sqlite3.connect(cache_path, timeout=CACHE_BUSY_TIMEOUT)
+
+def _analyze(variant_input):
+    """Serve an analysis from the shared cache, computing it on a miss
+
+    The cache is best-effort: if it is locked or unreadable the analysis is
+    computed and returned without it.
+    """
+    key = _cache_key(variant_input)
+    try:
+        row = _cache.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+    except sqlite3.Error:
+        row = None
+    if row is not None:
+        return json.loads(row[0])
+
+    results = match_index(variant_input, _kb_index, _load_impact)
+
+    try:
+        with _cache:
+            _cache.execute(
+                "INSERT OR REPLACE INTO results (key, kb_version, value) VALUES (?, ?, ?)",
+                (key, _kb_version, json.dumps(results))
+            )
+    except sqlite3.Error:
+        pass
+    return results
+
+class AnalysisPool:
+    """Dispatch analyses to a pool of stateless local worker processes"""
+
+    def __init__(self, database, workers, data_dir):
+        os.makedirs(data_dir, exist_ok=True)
+        kb_path = compile_kb(database, data_dir)
+        self.kb_path = kb_path
+        cache_path = os.path.join(data_dir, CACHE_FILENAME)
+        conn = open_cache(cache_path)
+        try:
+            prune_data_dir(data_dir, kb_path, conn)
+        finally:
+            conn.close()
+
+        # Spawn so workers start clean instead of inheriting the app's memory
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(kb_path, cache_path)
+        )
+
+    def submit(self, variant_input):
+        """Queue an analysis and return its future"""
+        return self._executor.submit(_analyze, variant_input)
+
+    def analyze(self, variant_input):
+        """Run an analysis on a worker and wait for the result"""
+        return self.submit(variant_input).result()
+
+    def shutdown(self, wait=True):
+        """Stop the worker processes"""
+        self._executor.shutdown(wait=wait)
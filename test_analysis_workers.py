@@ -0,0 +1,163 @@
+"""
+Tests for the analysis worker pool, KB snapshot and shared result cache
+
+Run:
+python -m pytest -q
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+import pytest
+
+import analysis_workers
+from analysis_workers import (
+    CACHE_FILENAME, KB_KEEP_VERSIONS, AnalysisPool, encode_kb, match_index, match_variants,
+    read_kb_index, snapshot_version
+)
+
+SAMPLE_DATABASE = {
+    "FSH (Follitropin alfa/delta)": {
+        "genes": ["FSHR", "FSHB"],
+        "impacts": {
+            "FSHR_rs6166_Ser/Ser": {"impact": "REDUCED_RESPONSE", "severity": "moderate"}
+        }
+    },
+    "Clomiphene citrate": {
+        "genes": ["CYP2D6"],
+        "impacts": {
+            "CYP2D6_*4/*4": {"impact": "REDUCED_METABOLISM", "severity": "high"}
+        }
+    }
+}
+
+SAMPLE_INPUT = "CYP2D6 *4/*4\nFSHR rs6166 Asn/Ser"
+
+@pytest.fixture
+def pool_factory(tmp_path):
+    """Build two-worker pools on a temporary data directory, shutting them down afterwards"""
+    pools = []
+
+    def make(database):
+        pool = AnalysisPool(database, 2, str(tmp_path))
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.shutdown()
+
+def test_match_variants_matches_in_process_results():
+    assert match_variants(SAMPLE_INPUT, SAMPLE_DATABASE) == {
+        "Clomiphene citrate": {
+            'impacts': [{
+                'key': "CYP2D6_*4/*4",
+                'data': SAMPLE_DATABASE["Clomiphene citrate"]["impacts"]["CYP2D6_*4/*4"]
+            }],
+            'no_impact_genes': [],
+            'relevant_genes': ["CYP2D6"]
+        },
+        "FSH (Follitropin alfa/delta)": {
+            'impacts': [],
+            'no_impact_genes': ["FSHR"],
+            'relevant_genes': ["FSHR", "FSHB"]
+        }
+    }
+
+def test_match_variants_empty_input():
+    assert match_variants(" \n\n", SAMPLE_DATABASE) is None
+
+def test_snapshot_matches_in_memory_database():
+    buffer = encode_kb(SAMPLE_DATABASE)
+    loaded = []
+
+    def load_impact(ref):
+        offset, length = ref
+        loaded.append(ref)
+        return json.loads(buffer[offset:offset + length])
+
+    index = read_kb_index(buffer)
+    assert match_index(SAMPLE_INPUT, index, load_impact) == match_variants(SAMPLE_INPUT, SAMPLE_DATABASE)
+    # Only the matched impact record is decoded
+    assert len(loaded) == 1
+
+def test_snapshot_rejects_other_files():
+    with pytest.raises(ValueError):
+        read_kb_index(b"{}")
+
+def test_cache_key_ignores_case_and_whitespace(monkeypatch):
+    monkeypatch.setattr(analysis_workers, '_kb_version', "test")
+    assert analysis_workers._cache_key(SAMPLE_INPUT) == analysis_workers._cache_key(
+        "  cyp2d6 *4/*4 \n\n fshr rs6166 asn/ser\n"
+    )
+
+def test_pool_matches_match_variants(pool_factory):
+    pool = pool_factory(SAMPLE_DATABASE)
+    assert pool.analyze(SAMPLE_INPUT) == match_variants(SAMPLE_INPUT, SAMPLE_DATABASE)
+    # Second call is served from the cache
+    assert pool.analyze(SAMPLE_INPUT) == match_variants(SAMPLE_INPUT, SAMPLE_DATABASE)
+    # Drugs keep the database order used for display
+    assert list(pool.analyze(SAMPLE_INPUT)) == list(SAMPLE_DATABASE)
+
+def test_kb_edit_invalidates_cache(pool_factory, tmp_path):
+    pool_factory(SAMPLE_DATABASE).analyze(SAMPLE_INPUT)
+
+    edited = {**SAMPLE_DATABASE, "Clomiphene citrate": {"genes": ["CYP2D6"], "impacts": {}}}
+    pool = pool_factory(edited)
+
+    assert pool.analyze(SAMPLE_INPUT) == match_variants(SAMPLE_INPUT, edited)
+
+def test_pool_start_prunes_old_kb_versions(pool_factory, tmp_path):
+    pools = []
+    for version in range(KB_KEEP_VERSIONS + 1):
+        database = {**SAMPLE_DATABASE, f"Drug {version}": {"genes": ["GENE"], "impacts": {}}}
+        pools.append(pool_factory(database))
+        pools[-1].analyze(SAMPLE_INPUT)
+        pools[-1].shutdown()
+
+    snapshots = sorted(f for f in os.listdir(tmp_path) if f.startswith("kb-"))
+    assert snapshots == sorted(os.path.basename(p.kb_path) for p in pools[1:])
+
+    conn = sqlite3.connect(os.path.join(tmp_path, CACHE_FILENAME))
+    versions = {row[0] for row in conn.execute("SELECT kb_version FROM results")}
+    assert versions == {snapshot_version(p.kb_path) for p in pools[1:]}
+
+def test_locked_cache_does_not_fail_analysis(pool_factory, tmp_path):
+    pool = pool_factory(SAMPLE_DATABASE)
+    conn = sqlite3.connect(os.path.join(tmp_path, CACHE_FILENAME), isolation_level=None)
+    conn.execute("BEGIN EXCLUSIVE")
+    try:
+        started = time.monotonic()
+        assert pool.analyze(SAMPLE_INPUT) == match_variants(SAMPLE_INPUT, SAMPLE_DATABASE)
+        assert time.monotonic() - started < 10
+    finally:
+        conn.execute("ROLLBACK")
+        conn.close()
+
+def test_new_kb_version_keeps_running_pool_working(tmp_path):
+    old_pool = AnalysisPool(SAMPLE_DATABASE, 4, str(tmp_path))
+    try:
+        assert old_pool.analyze(SAMPLE_INPUT) == match_variants(SAMPLE_INPUT, SAMPLE_DATABASE)
+
+        # A rolling deploy starts a pool on an edited database in the same directory
+        edited = {**SAMPLE_DATABASE, "Clomiphene citrate": {"genes": ["CYP2D6"], "impacts": {}}}
+        new_pool = AnalysisPool(edited, 2, str(tmp_path))
+        new_pool.shutdown()
+
+        assert os.path.exists(old_pool.kb_path)
+        # The old pool still starts further workers from its own snapshot
+        for wave in range(2):
+            futures = [old_pool.submit(f"{SAMPLE_INPUT}\nGENE{wave}{i}") for i in range(8)]
+            assert all(f.result() is not None for f in futures)
+    finally:
+        old_pool.shutdown()
+
+def test_pool_matches_analyze_variants(pool_factory):
+    pytest.importorskip("streamlit")
+    import variant_analyzer
+
+    pool = pool_factory(variant_analyzer.DRUG_GENE_DATABASE)
+    for variant_input in (SAMPLE_INPUT, "CYP2A6*4/*4\nNR3C1 N363S Ser/Ser\nGHR d3/d3"):
+        assert pool.analyze(variant_input) == variant_analyzer.analyze_variants(variant_input)
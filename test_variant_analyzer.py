@@ -0,0 +1,172 @@
+"""
+Tests for the report section of the IVF Drug-Gene Interaction Analyser
+
+Run:
+python -m pytest -q
+"""
+
+import multiprocessing
+
+import pytest
+
+st = pytest.importorskip("streamlit")
+
+from streamlit.testing.v1 import AppTest
+
+from variant_analyzer import ALL_MEDICATIONS, filter_by_severity
+
+# Five medications with significant variants: two pages of report
+MULTI_DRUG_INPUT = """CYP2D6*4/*4
+FSHR rs6166 Ser/Ser
+SLC22A1 Met420del
+CYP2A6*4/*4
+LHCGR rs2293275 A/G
+NR3C1 N363S Ser/Ser
+GHR d3/d3"""
+
+SINGLE_DRUG_INPUT = "GHR d3/d3"
+
+def impact(key, severity):
+    """Build a matched impact entry with only its severity"""
+    return {'key': key, 'data': {'severity': severity}}
+
+def shown_drugs(at):
+    """Return the medications rendered as full impact sections"""
+    prefix = "## 💊 "
+    return [m.value[len(prefix):] for m in at.markdown if m.value.startswith(prefix)]
+
+def generate(at, variant_input):
+    """Enter variants and generate the report"""
+    at.text_area[0].input(variant_input)
+    next(b for b in at.button if b.label.startswith("🔬")).click()
+    return at.run()
+
+@pytest.fixture
+def app():
+    return AppTest.from_file("variant_analyzer.py").run()
+
+@pytest.fixture
+def pooled_app(monkeypatch, tmp_path):
+    """Run the app in worker-pool mode with a fresh pool"""
+    monkeypatch.setenv("IVFPGX_WORKERS", "2")
+    monkeypatch.setenv("IVFPGX_DATA_DIR", str(tmp_path / "data"))
+    st.cache_resource.clear()
+    yield AppTest.from_file("variant_analyzer.py", default_timeout=30).run()
+    st.cache_resource.clear()
+    for process in multiprocessing.active_children():
+        process.kill()
+
+def test_filter_by_severity():
+    drugs = [
+        ("Drug A", {'impacts': [impact("A_1", 'high'), impact("A_2", 'mild')], 'relevant_genes': ["A"]}),
+        ("Drug B", {'impacts': [impact("B_1", 'moderate')], 'relevant_genes': ["B"]})
+    ]
+
+    filtered = filter_by_severity(drugs, ['high'])
+
+    assert filtered == [("Drug A", {'impacts': [impact("A_1", 'high')], 'relevant_genes': ["A"]})]
+    # The stored results are left untouched
+    assert len(drugs[0][1]['impacts']) == 2
+    assert filter_by_severity(drugs, []) == []
+
+def test_report_pages(app):
+    at = generate(app, MULTI_DRUG_INPUT)
+    assert not at.exception
+    assert shown_drugs(at) == ["FSH (Follitropin alfa/delta)", "Metformin", "LH supplementation"]
+
+    at.radio(key="report_page").set_value(2).run()
+    assert shown_drugs(at) == ["Corticosteroids", "Growth Hormone"]
+
+def test_severity_filter_shrinks_pages(app):
+    at = generate(app, MULTI_DRUG_INPUT)
+    at.radio(key="report_page").set_value(2).run()
+
+    at.multiselect(key="report_severity").set_value(['high']).run()
+
+    assert not at.exception
+    assert shown_drugs(at) == ["Metformin", "Corticosteroids"]
+    assert len(at.radio) == 0
+
+def test_detail_drug_resets_when_filtered_out(app):
+    at = generate(app, MULTI_DRUG_INPUT)
+    at.selectbox(key="report_drug").set_value("Metformin").run()
+    assert shown_drugs(at) == ["Metformin"]
+
+    at.multiselect(key="report_severity").set_value(['moderate']).run()
+
+    assert not at.exception
+    assert at.selectbox(key="report_drug").value == ALL_MEDICATIONS
+    assert shown_drugs(at) == ["FSH (Follitropin alfa/delta)", "LH supplementation", "Growth Hormone"]
+
+def test_regenerate_resets_report_filters(app):
+    at = generate(app, MULTI_DRUG_INPUT)
+    at.multiselect(key="report_severity").set_value(['high']).run()
+    at.selectbox(key="report_drug").set_value("Corticosteroids").run()
+
+    at = generate(at, SINGLE_DRUG_INPUT)
+
+    assert not at.exception
+    assert at.multiselect(key="report_severity").value == ['high', 'moderate', 'mild', 'none']
+    assert at.selectbox(key="report_drug").value == ALL_MEDICATIONS
+    assert shown_drugs(at) == ["Growth Hormone"]
+    assert at.caption[0].value == "🧬 Report generated for: GHR d3/d3"
+
+def test_sample_profile_marks_report_out_of_date(app):
+    at = generate(app, SINGLE_DRUG_INPUT)
+    assert not any("out of date" in w.value for w in at.warning)
+
+    at.button[0].click().run()
+
+    assert not at.exception
+    assert at.text_area[0].value == "CYP2D6*4/*4\nFSHR rs6166 Ser/Ser\nSLC22A1 Met420del"
+    assert any("out of date" in w.value for w in at.warning)
+    assert shown_drugs(at) == ["Growth Hormone"]
+
+def test_empty_input_clears_report(app):
+    at = generate(app, SINGLE_DRUG_INPUT)
+    assert shown_drugs(at) == ["Growth Hormone"]
+
+    at = generate(at, "")
+
+    assert not at.exception
+    assert at.session_state.report_results is None
+    assert shown_drugs(at) == []
+    assert [e.value for e in at.error] == ["❌ Please enter at least one genetic variant"]
+
+def test_pool_mode_report(pooled_app):
+    at = generate(pooled_app, MULTI_DRUG_INPUT)
+
+    assert not at.exception
+    assert len(at.error) == 0
+    assert shown_drugs(at) == ["FSH (Follitropin alfa/delta)", "Metformin", "LH supplementation"]
+
+def test_pool_mode_recovers_from_crashed_worker(pooled_app):
+    at = generate(pooled_app, SINGLE_DRUG_INPUT)
+    for process in multiprocessing.active_children():
+        process.kill()
+        process.join()
+
+    at = generate(at, MULTI_DRUG_INPUT)
+
+    assert not at.exception
+    assert "worker stopped unexpectedly" in at.error[0].value
+    assert shown_drugs(at) == ["FSH (Follitropin alfa/delta)", "Metformin", "LH supplementation"]
+
+    # The next analysis runs on a fresh pool
+    at = generate(at, SINGLE_DRUG_INPUT)
+    assert not at.exception
+    assert len(at.error) == 0
+    assert shown_drugs(at) == ["Growth Hormone"]
+
+def test_pool_mode_falls_back_when_pool_cannot_start(monkeypatch, tmp_path):
+    blocker = tmp_path / "not-a-directory"
+    blocker.write_text("")
+    monkeypatch.setenv("IVFPGX_WORKERS", "2")
+    monkeypatch.setenv("IVFPGX_DATA_DIR", str(blocker))
+    st.cache_resource.clear()
+
+    at = generate(AppTest.from_file("variant_analyzer.py").run(), SINGLE_DRUG_INPUT)
+
+    assert not at.exception
+    assert "could not be started" in at.error[0].value
+    assert shown_drugs(at) == ["Growth Hormone"]
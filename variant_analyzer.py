@@ -9,8 +9,15 @@ Run:
 streamlit run variant_analyzer.py
 """
 
+import math
+import os
+import sqlite3
+from concurrent.futures.process import BrokenProcessPool
+
 import streamlit as st
 
+from analysis_workers import AnalysisPool, match_variants
+
 # Page configuration
 st.set_page_config(
     page_title="IVF Drug-Gene Analyser",
@@ -43,6 +50,16 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Report display settings
+SEVERITY_LEVELS = ['high', 'moderate', 'mild', 'none']
+ALL_MEDICATIONS = "All medications"
+DRUGS_PER_PAGE = 3
+REPORT_WIDGET_KEYS = ('report_severity', 'report_drug', 'report_page')
+
+# Optional worker-pool deployment mode; 0 keeps analysis in the app process
+ANALYSIS_WORKERS = int(os.environ.get('IVFPGX_WORKERS', '0'))
+ANALYSIS_DATA_DIR = os.environ.get('IVFPGX_DATA_DIR', '.ivfpgx')
+
 # Drug-Gene-Impact Database
 DRUG_GENE_DATABASE = {
     "FSH (Follitropin alfa/delta)": {
@@ -487,49 +504,239 @@ def render_impact_card(variant_key, impact_data):
 
 def analyze_variants(variant_input):
     """Analyze input variants against drug database"""
-    input_variants = [v.strip().upper() for v in variant_input.split('\n') if v.strip()]
+    return match_variants(variant_input, DRUG_GENE_DATABASE)
+
+@st.cache_resource
+def get_analysis_pool():
+    """Start the shared analysis worker pool once per server process"""
+    return AnalysisPool(DRUG_GENE_DATABASE, ANALYSIS_WORKERS, ANALYSIS_DATA_DIR)
+
+def analyze_with_pool(variant_input):
+    """Analyze variants on the worker pool, falling back to the app process"""
+    try:
+        pool = get_analysis_pool()
+    except (OSError, sqlite3.Error):
+        st.session_state.report_error = "❌ The analysis worker pool could not be started. This report was generated in the app process."
+        return analyze_variants(variant_input)
+    
+    try:
+        return pool.analyze(variant_input)
+    except (BrokenProcessPool, RuntimeError):
+        # A crashed worker breaks the whole pool; replace it unless another session already has
+        pool.shutdown(wait=False)
+        try:
+            if get_analysis_pool() is pool:
+                get_analysis_pool.clear()
+        except (OSError, sqlite3.Error):
+            pass
+        st.session_state.report_error = "❌ An analysis worker stopped unexpectedly. This report was generated in the app process and the worker pool will be restarted."
+        return analyze_variants(variant_input)
+
+def run_analysis(variant_input):
+    """Analyze variants once and hold the result in session state"""
+    if st.session_state.report_input != variant_input:
+        if ANALYSIS_WORKERS > 0:
+            st.session_state.report_results = analyze_with_pool(variant_input)
+        else:
+            st.session_state.report_results = analyze_variants(variant_input)
+        st.session_state.report_input = variant_input
+        # A new report starts unfiltered on the first page
+        for key in REPORT_WIDGET_KEYS:
+            st.session_state.pop(key, None)
+    return st.session_state.report_results
+
+def clear_report():
+    """Drop the stored report and its filter state"""
+    st.session_state.report_input = None
+    st.session_state.report_results = None
+    for key in REPORT_WIDGET_KEYS:
+        st.session_state.pop(key, None)
+
+def split_drug_results(results):
+    """Separate drugs into those with impacts and those analysed without impact"""
+    drugs_with_impacts = []
+    drugs_no_impact = []
+    
+    for drug, data in results.items():
+        if data['impacts']:
+            drugs_with_impacts.append((drug, data))
+        elif data['no_impact_genes']:
+            drugs_no_impact.append((drug, data))
+    
+    return drugs_with_impacts, drugs_no_impact
+
+def filter_by_severity(drugs_with_impacts, severities):
+    """Keep only impacts matching the selected severities, dropping empty drugs"""
+    filtered = []
+    for drug, data in drugs_with_impacts:
+        impacts = [i for i in data['impacts'] if i['data']['severity'] in severities]
+        if impacts:
+            filtered.append((drug, {**data, 'impacts': impacts}))
+    return filtered
+
+@st.fragment
+def render_input_section():
+    """Render variant input; sample profiles and typing rerun only this fragment"""
+    st.markdown("## 🔍 Enter Patient Genetic Variants")
+    
+    # Quick example buttons
+    st.markdown("**💡 Sample Patient Profiles:**")
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        if st.button("🔴 Poor Responder Profile"):
+            st.session_state.variant_input = "CYP2D6*4/*4\nFSHR rs6166 Ser/Ser\nSLC22A1 Met420del"
+    
+    with col2:
+        if st.button("🟡 High Sensitivity Profile"):
+            st.session_state.variant_input = "CYP2A6*4/*4\nNR3C1 N363S Ser/Ser\nGHR d3/d3"
+    
+    with col3:
+        if st.button("🟢 Normal Metabolizer"):
+            st.session_state.variant_input = "CYP2D6*1/*1\nCYP2A6*1/*1\nFSHR rs6166 Asn/Ser"
+    
+    # Text area with session state
+    variant_input = st.text_area(
+        "Enter patient genetic variants (one per line):",
+        value=st.session_state.variant_input,
+        height=200,
+        placeholder="""Enter patient genetic variants (one per line):
+
+Examples:
+CYP2D6*4/*4
+FSHR rs6166 Ser/Ser
+SLC22A1 Met420del
+CYP2A6*4/*4
+LHCGR rs2293275 A/G""",
+        help="Enter one variant per line. Examples: CYP2D6*4/*4, FSHR rs6166 Ser/Ser"
+    )
+    
+    # Warn when the stored report no longer matches the variants on screen
+    if st.session_state.report_results and variant_input != st.session_state.report_input:
+        st.warning("⚠️ **Report is out of date** - the variants above have changed since the report below was generated. Regenerate the report before using it.")
+    
+    # Analyze button
+    if st.button("🔬 Generate Pharmacogenomic Report", type="primary"):
+        if not variant_input.strip():
+            # Never leave a previous patient's report on screen
+            clear_report()
+            st.session_state.report_error = "❌ Please enter at least one genetic variant"
+        else:
+            with st.spinner("Analyzing genetic variants..."):
+                run_analysis(variant_input)
+        # Full rerun so the report fragment picks up the new results
+        st.rerun()
+    
+    report_error = st.session_state.pop('report_error', None)
+    if report_error:
+        st.error(report_error)
+
+@st.fragment
+def render_report():
+    """Render the stored report; filtering, paging and drug detail rerun only this fragment"""
+    results = st.session_state.report_results
+    if not results:
+        return
     
-    if not input_variants:
-        return None
+    drugs_with_impacts, drugs_no_impact = split_drug_results(results)
     
-    drug_results = {}
+    # Show which input this report was built from
+    report_variants = [v.strip() for v in st.session_state.report_input.split('\n') if v.strip()]
+    st.caption(f"🧬 Report generated for: {', '.join(report_variants)}")
     
-    for drug, drug_data in DRUG_GENE_DATABASE.items():
-        matched_impacts = []
-        no_impact_genes = []
+    # Show success message with count
+    if drugs_with_impacts:
+        st.success(f"✅ Pharmacogenomic Analysis Complete - {len(drugs_with_impacts)} medication(s) with clinically significant variants identified")
+    else:
+        st.info("ℹ️ Analysis Complete - No clinically significant variants detected for the provided genetic data")
+    
+    # Display drugs WITH impacts first
+    if drugs_with_impacts:
+        st.markdown("### 🎯 Medications with Clinically Significant Variants")
         
-        # Check for matching variants
-        for variant in input_variants:
-            for impact_key, impact_data in drug_data['impacts'].items():
-                # Flexible matching
-                if (variant in impact_key.replace('_', ' ').upper() or 
-                    impact_key.replace('_', ' ').upper() in variant or
-                    variant.split('_')[0] in impact_key.split('_')[0]):
-                    matched_impacts.append({
-                        'key': impact_key,
-                        'data': impact_data
-                    })
+        filter_col, detail_col = st.columns(2)
+        with filter_col:
+            severities = st.multiselect(
+                "Filter by severity:",
+                SEVERITY_LEVELS,
+                default=SEVERITY_LEVELS,
+                format_func=str.capitalize,
+                key="report_severity"
+            )
+        filtered_drugs = filter_by_severity(drugs_with_impacts, severities)
         
-        # Check for genes without impact
-        for gene in drug_data['genes']:
-            has_match = any(gene.upper() in v or v.split('_')[0] in gene for v in input_variants)
-            has_impact = any(gene in m['key'] for m in matched_impacts)
-            if has_match and not has_impact:
-                no_impact_genes.append(gene)
+        drug_options = [ALL_MEDICATIONS] + [drug for drug, _ in filtered_drugs]
+        if st.session_state.get('report_drug') not in drug_options:
+            st.session_state.report_drug = ALL_MEDICATIONS
+        with detail_col:
+            selected_drug = st.selectbox("Medication detail:", drug_options, key="report_drug")
+        if selected_drug != ALL_MEDICATIONS:
+            filtered_drugs = [(drug, data) for drug, data in filtered_drugs if drug == selected_drug]
         
-        drug_results[drug] = {
-            'impacts': matched_impacts,
-            'no_impact_genes': no_impact_genes,
-            'relevant_genes': drug_data['genes']
-        }
+        page_count = max(1, math.ceil(len(filtered_drugs) / DRUGS_PER_PAGE))
+        if st.session_state.get('report_page', 1) > page_count:
+            st.session_state.report_page = 1
+        page = 1
+        if page_count > 1:
+            page = st.radio("Page:", list(range(1, page_count + 1)), horizontal=True, key="report_page")
+        
+        if not filtered_drugs:
+            st.info("ℹ️ No variants match the selected severity levels")
+        
+        start = (page - 1) * DRUGS_PER_PAGE
+        for drug, data in filtered_drugs[start:start + DRUGS_PER_PAGE]:
+            st.markdown(f"## 💊 {drug}")
+            st.info(f"📊 {len(data['impacts'])} clinically significant variant(s) identified for this medication")
+            
+            for impact in data['impacts']:
+                render_impact_card(impact['key'], impact['data'])
+            
+            st.markdown("---")
+    
+    # Display drugs with NO impact at the bottom (optional - can be hidden)
+    if drugs_no_impact:
+        with st.expander(f"ℹ️ Additional Medications Analyzed ({len(drugs_no_impact)} drugs with no significant variants)", expanded=False):
+            for drug, data in drugs_no_impact:
+                st.markdown(f"### 💊 {drug}")
+                st.success(f"""
+                ✅ **No Clinically Significant Variants Detected**
+                
+                Patient genetic profile for **{', '.join(data['no_impact_genes'])}** shows no known variants 
+                affecting {drug} response or metabolism based on current pharmacogenomic evidence.
+                
+                ℹ️ Standard dosing protocols are appropriate for this patient.
+                """)
+                st.markdown("---")
     
-    return drug_results
+    # Summary - only show if there are actionable findings
+    if drugs_with_impacts:
+        st.markdown("""
+        <div style="background-color: #1e293b; padding: 1.5rem; border-radius: 1rem; border: 2px solid #3b82f6; color: #ffffff;">
+            <h3 style="color: #60a5fa; margin-top: 0;">📋 Clinical Action Items</h3>
+            <ul style="color: #e2e8f0;">
+                <li>✅ Review pharmacogenomic impact levels for each medication</li>
+                <li>✅ Access referenced databases for detailed evidence review</li>
+                <li>✅ Integrate findings with patient's clinical history and current protocols</li>
+                <li>✅ Consider dose adjustments or alternative agents where indicated</li>
+                <li>✅ Document pharmacogenomic considerations in patient record</li>
+            </ul>
+            <div style="background-color: #fef3c7; padding: 1rem; border-radius: 0.5rem; border-left: 4px solid #f59e0b; margin-top: 1rem; color: #78350f;">
+                <p style="margin: 0; font-weight: 600;">⚠️ Clinical Interpretation Note:</p>
+                <p style="margin: 0.5rem 0 0 0;">These pharmacogenomic insights should be integrated with comprehensive patient assessment including medical history, concurrent medications, comorbidities, and individualized treatment goals. Clinical judgment remains paramount in all treatment decisions.</p>
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
 
 def main():
     # Initialize session state for variant input
     if 'variant_input' not in st.session_state:
         st.session_state.variant_input = ""
     
+    # Initialize session state for the computed report
+    if 'report_results' not in st.session_state:
+        st.session_state.report_input = None
+        st.session_state.report_results = None
+    
     # Header
     st.markdown("""
     <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 2rem; border-radius: 1rem; color: white; margin-bottom: 2rem;">
@@ -577,114 +784,9 @@ def main():
         - ⚠️ **Altered:** Variable response - individualized monitoring recommended
         """)
     
-    # Input Section
-    st.markdown("## 🔍 Enter Patient Genetic Variants")
-    
-    # Quick example buttons
-    st.markdown("**💡 Sample Patient Profiles:**")
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        if st.button("🔴 Poor Responder Profile"):
-            st.session_state.variant_input = "CYP2D6*4/*4\nFSHR rs6166 Ser/Ser\nSLC22A1 Met420del"
-            st.rerun()
-    
-    with col2:
-        if st.button("🟡 High Sensitivity Profile"):
-            st.session_state.variant_input = "CYP2A6*4/*4\nNR3C1 N363S Ser/Ser\nGHR d3/d3"
-            st.rerun()
-    
-    with col3:
-        if st.button("🟢 Normal Metabolizer"):
-            st.session_state.variant_input = "CYP2D6*1/*1\nCYP2A6*1/*1\nFSHR rs6166 Asn/Ser"
-            st.rerun()
-    
-    # Text area with session state
-    variant_input = st.text_area(
-        "Enter patient genetic variants (one per line):",
-        value=st.session_state.variant_input,
-        height=200,
-        placeholder="""Enter patient genetic variants (one per line):
-
-Examples:
-CYP2D6*4/*4
-FSHR rs6166 Ser/Ser
-SLC22A1 Met420del
-CYP2A6*4/*4
-LHCGR rs2293275 A/G""",
-        help="Enter one variant per line. Examples: CYP2D6*4/*4, FSHR rs6166 Ser/Ser"
-    )
-    
-    # Analyze button
-    if st.button("🔬 Generate Pharmacogenomic Report", type="primary"):
-        if not variant_input.strip():
-            st.error("❌ Please enter at least one genetic variant")
-        else:
-            with st.spinner("Analyzing genetic variants..."):
-                results = analyze_variants(variant_input)
-                
-                if results:
-                    # Separate drugs into categories
-                    drugs_with_impacts = []
-                    drugs_no_impact = []
-                    
-                    for drug, data in results.items():
-                        if data['impacts']:
-                            drugs_with_impacts.append((drug, data))
-                        elif data['no_impact_genes']:
-                            drugs_no_impact.append((drug, data))
-                    
-                    # Show success message with count
-                    if drugs_with_impacts:
-                        st.success(f"✅ Pharmacogenomic Analysis Complete - {len(drugs_with_impacts)} medication(s) with clinically significant variants identified")
-                    else:
-                        st.info("ℹ️ Analysis Complete - No clinically significant variants detected for the provided genetic data")
-                    
-                    # Display drugs WITH impacts first
-                    if drugs_with_impacts:
-                        st.markdown("### 🎯 Medications with Clinically Significant Variants")
-                        for drug, data in drugs_with_impacts:
-                            st.markdown(f"## 💊 {drug}")
-                            st.info(f"📊 {len(data['impacts'])} clinically significant variant(s) identified for this medication")
-                            
-                            for impact in data['impacts']:
-                                render_impact_card(impact['key'], impact['data'])
-                            
-                            st.markdown("---")
-                    
-                    # Display drugs with NO impact at the bottom (optional - can be hidden)
-                    if drugs_no_impact:
-                        with st.expander(f"ℹ️ Additional Medications Analyzed ({len(drugs_no_impact)} drugs with no significant variants)", expanded=False):
-                            for drug, data in drugs_no_impact:
-                                st.markdown(f"### 💊 {drug}")
-                                st.success(f"""
-                                ✅ **No Clinically Significant Variants Detected**
-                                
-                                Patient genetic profile for **{', '.join(data['no_impact_genes'])}** shows no known variants 
-                                affecting {drug} response or metabolism based on current pharmacogenomic evidence.
-                                
-                                ℹ️ Standard dosing protocols are appropriate for this patient.
-                                """)
-                                st.markdown("---")
-                    
-                    # Summary - only show if there are actionable findings
-                    if drugs_with_impacts:
-                        st.markdown("""
-                        <div style="background-color: #1e293b; padding: 1.5rem; border-radius: 1rem; border: 2px solid #3b82f6; color: #ffffff;">
-                            <h3 style="color: #60a5fa; margin-top: 0;">📋 Clinical Action Items</h3>
-                            <ul style="color: #e2e8f0;">
-                                <li>✅ Review pharmacogenomic impact levels for each medication</li>
-                                <li>✅ Access referenced databases for detailed evidence review</li>
-                                <li>✅ Integrate findings with patient's clinical history and current protocols</li>
-                                <li>✅ Consider dose adjustments or alternative agents where indicated</li>
-                                <li>✅ Document pharmacogenomic considerations in patient record</li>
-                            </ul>
-                            <div style="background-color: #fef3c7; padding: 1rem; border-radius: 0.5rem; border-left: 4px solid #f59e0b; margin-top: 1rem; color: #78350f;">
-                                <p style="margin: 0; font-weight: 600;">⚠️ Clinical Interpretation Note:</p>
-                                <p style="margin: 0.5rem 0 0 0;">These pharmacogenomic insights should be integrated with comprehensive patient assessment including medical history, concurrent medications, comorbidities, and individualized treatment goals. Clinical judgment remains paramount in all treatment decisions.</p>
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True)
+    # Input and report sections rerun independently as fragments
+    render_input_section()
+    render_report()
 
 if __name__ == "__main__":
     main()